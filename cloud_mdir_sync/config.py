@@ -1,13 +1,19 @@
 # SPDX-License-Identifier: GPL-2.0+
 import asyncio
-import itertools
+import contextlib
+import hashlib
 import logging
+import marshal
 import os
-from typing import TYPE_CHECKING, Any, Dict, List
+import sys
+import tempfile
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
 
 import pyinotify
+from cryptography.fernet import Fernet
 
 if TYPE_CHECKING:
+    import aiohttp
     from . import messages, mailbox, oauth
 
 logger: logging.Logger
@@ -16,6 +22,15 @@ logger: logging.Logger
 class Config(object):
     """Program configuration and general global state"""
     message_db_dir = "~/mail/.cms/"
+    config_cache_dir = "~/.cache/cloud_mdir_sync/configcache/"
+    # Maximum number of mailboxes to run update_message_list on concurrently
+    max_concurrent_fetches = 8
+    # Set by the configuration file if direct_message only depends on the
+    # message content and cloud mailbox, allowing its results to be reused
+    direct_message_is_pure = False
+    # Seconds to wait after a change event so bursts of events are handled
+    # by a single update cycle
+    coalesce_window = 0.1
     trace_file: Any = None
     web_app: "oauth.WebServer"
     logger: logging.Logger
@@ -24,6 +39,11 @@ class Config(object):
     msgdb: "messages.MessageDB"
     cloud_mboxes: "List[mailbox.Mailbox]"
     local_mboxes: "List[mailbox.Mailbox]"
+    _all_mboxes: "Optional[Tuple[mailbox.Mailbox, ...]]" = None
+    _resolver: "Optional[oauth.CachingResolver]" = None
+    _storage_key: Optional[bytes] = None
+    _storage_crypto: Optional[Fernet] = None
+    _CONFIG_NAMES: Tuple[str, ...]
 
     def _create_logger(self):
         global logger
@@ -43,40 +63,121 @@ class Config(object):
         self.local_mboxes = []
         self.async_tasks = []
         self.message_db_dir = os.path.expanduser(self.message_db_dir)
+        self.config_cache_dir = os.path.expanduser(self.config_cache_dir)
         self.direct_message = self._direct_message
+        self._config_globals = {
+            k: getattr(self, k)
+            for k in self._CONFIG_NAMES
+        }
 
     def load_config(self, fn):
         """The configuration file is a python script that we execute with
         capitalized functions of this class injected into it"""
         fn = os.path.expanduser(fn)
-        with open(fn, "r") as F:
-            pyc = compile(source=F.read(), filename=fn, mode="exec")
+        pyc = self._compile_config(fn)
 
-        g = {"cfg": self}
-        for k in dir(self):
-            if k[0].isupper():
-                g[k] = getattr(self, k)
+        g = {"cfg": self, **self._config_globals}
         eval(pyc, g)
 
+    def _compile_config(self, fn):
+        """Return the code object for the configuration file. The compiled
+        code is cached on disk in one file per configuration file name. The
+        cache file also stores a hash of the interpreter version, mtime and
+        content, and is only used if that still matches."""
+        fn = os.path.abspath(fn)
+        with open(fn, "rb") as F:
+            source = F.read()
+            st = os.fstat(F.fileno())
+
+        m = hashlib.sha256()
+        m.update(sys.implementation.cache_tag.encode())
+        m.update(str(st.st_mtime_ns).encode())
+        m.update(source)
+        source_hash = m.digest()
+        cfn = os.path.join(self.config_cache_dir,
+                           hashlib.sha256(fn.encode()).hexdigest() + ".pyc")
+
+        try:
+            with open(cfn, "rb") as F:
+                cached_hash, pyc = marshal.load(F)
+            if cached_hash == source_hash:
+                return pyc
+        except (IOError, EOFError, ValueError, TypeError):
+            pass
+
+        pyc = compile(source=source, filename=fn, mode="exec")
+        tmp_fn = None
+        try:
+            os.makedirs(self.config_cache_dir, exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=self.config_cache_dir,
+                                             suffix=".tmp",
+                                             delete=False) as F:
+                tmp_fn = F.name
+                marshal.dump((source_hash, pyc), F)
+            os.rename(tmp_fn, cfn)
+        except IOError:
+            if tmp_fn is not None:
+                with contextlib.suppress(IOError):
+                    os.unlink(tmp_fn)
+        return pyc
+
     @property
     def storage_key(self):
         """The storage key is used with fernet to manage the authentication
         data, which is stored to disk using symmetric encryption. The
         decryption key is keld by the system keyring in some secure storage.
         On Linux desktop systems this is likely to be something like
-        gnome-keyring."""
+        gnome-keyring. The key is only fetched from the keyring once, and
+        MessageDB only uses it while loading or saving its state, outside
+        the running event loop, so the blocking keyring IPC never stalls the
+        synchronizing loop."""
+        if self._storage_key is not None:
+            return self._storage_key
+
+        # keyring probes for backends on import, only pay for it when the
+        # key is actually needed
         import keyring
-        from cryptography.fernet import Fernet
 
         ring = keyring.get_keyring()
         res = ring.get_password("cloud_mdir_sync", "storage")
         if res is None:
             res = Fernet.generate_key()
             ring.set_password("cloud_mdir_sync", "storage", res)
+        self._storage_key = res
         return res
 
+    @property
+    def storage_crypto(self):
+        """A cached fernet instance using storage_key"""
+        if self._storage_crypto is None:
+            self._storage_crypto = Fernet(self.storage_key)
+        return self._storage_crypto
+
+    def new_connector(self, limit: int,
+                      limit_per_host: int) -> "aiohttp.TCPConnector":
+        """Create the connection pool for one account. Each account keeps its
+        own pool so its connection limits are not shared with other accounts,
+        but all the pools use the same DNS cache and keepalive time."""
+        import aiohttp
+        from .oauth import CachingResolver
+        if self._resolver is None:
+            self._resolver = CachingResolver(ttl=300)
+        return aiohttp.TCPConnector(limit=limit,
+                                    limit_per_host=limit_per_host,
+                                    resolver=self._resolver,
+                                    use_dns_cache=False,
+                                    keepalive_timeout=75)
+
+    async def close_resolver(self):
+        if self._resolver is not None:
+            await self._resolver.close()
+            self._resolver = None
+
     def all_mboxes(self):
-        return itertools.chain(self.local_mboxes, self.cloud_mboxes)
+        if self._all_mboxes is None:
+            self._all_mboxes = tuple(self.local_mboxes) + tuple(
+                self.cloud_mboxes)
+        return self._all_mboxes
 
     def Office365_Account(self, user=None, tenant="common"):
         """Define an Office365 account credential. If user is left as None
@@ -91,6 +192,7 @@ class Config(object):
         """Create a cloud mailbox for Office365. Mailbox is the name of O365
         mailbox to use, account should be the result of Office365_Account"""
         from .office365 import O365Mailbox
+        self._all_mboxes = None
         self.cloud_mboxes.append(
             O365Mailbox(self, mailbox, account))
         return self.cloud_mboxes[-1]
@@ -107,12 +209,14 @@ class Config(object):
         """Create a cloud mailbox for Office365. Mailbox is the name of O365
         mailbox to use, account should be the result of Office365_Account"""
         from .gmail import GMailMailbox
+        self._all_mboxes = None
         self.cloud_mboxes.append(GMailMailbox(self, label, account))
         return self.cloud_mboxes[-1]
 
     def MailDir(self, directory):
         """Create a local maildir to hold messages"""
         from .maildir import MailDirMailbox
+        self._all_mboxes = None
         self.local_mboxes.append(MailDirMailbox(self, directory))
         return self.local_mboxes[-1]
 
@@ -132,3 +236,8 @@ class Config(object):
 
     def _direct_message(self, msg):
         return self.local_mboxes[0]
+
+
+# Capitalized methods are injected into the global namespace of the
+# configuration file
+Config._CONFIG_NAMES = tuple(k for k in vars(Config) if k[:1].isupper())
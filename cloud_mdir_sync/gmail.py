@@ -83,7 +83,7 @@ class GmailAPI(oauth.Account):
     async def go(self):
         cfg = self.cfg
 
-        connector = aiohttp.connector.TCPConnector(limit=20, limit_per_host=5)
+        connector = cfg.new_connector(limit=20, limit_per_host=5)
         self.session = aiohttp.ClientSession(connector=connector,
                                              raise_for_status=False)
 
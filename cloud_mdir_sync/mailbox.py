@@ -46,6 +46,8 @@ class Mailbox(object):
 
     def __init__(self, cfg: "config.Config"):
         self.cfg = cfg
+        # Local mailbox each message was directed to by route_cloud_messages
+        self.routes: "Dict[str, Mailbox]" = {}
 
     @abstractmethod
     async def setup_mbox(self) -> None:
@@ -67,13 +69,12 @@ class Mailbox(object):
                       mdict: "CHMsgMappingDict_Type",
                       tuple_form=False) -> bool:
         """Return true if mdict is the same as the local messages"""
-        if len(self.messages) != len(mdict):
+        if (len(self.messages) != len(mdict)
+                or self.messages.keys() != mdict.keys()):
             return False
 
         for ch, mmsg in self.messages.items():
-            omsg = mdict.get(ch)
-            if omsg is None:
-                return False
+            omsg = mdict[ch]
 
             # update_cloud_from_local use a different dict format
             if tuple_form:
@@ -81,6 +82,8 @@ class Mailbox(object):
                 if omsg is None:
                     return False
 
+            if mmsg is omsg:
+                continue
             if (mmsg.content_hash != omsg.content_hash
                     or mmsg.flags != omsg.flags):
                 return False
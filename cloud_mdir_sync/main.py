@@ -15,16 +15,40 @@ from .util import asyncio_complete
 
 def route_cloud_messages(cfg: config.Config) -> messages.MBoxDict_Type:
     """For every cloud message figure out which local mailbox it belongs to"""
-    msgs: messages.MBoxDict_Type = {}
-    for mbox in cfg.local_mboxes:
-        msgs[mbox] = {}
+    msgs: messages.MBoxDict_Type = {mbox: {} for mbox in cfg.local_mboxes}
+    direct = cfg.direct_message
+    file_hashes = cfg.msgdb.file_hashes
+
     for mbox in cfg.cloud_mboxes:
-        for ch, msg in mbox.messages.items():
-            if ch not in cfg.msgdb.file_hashes:
+        for ch in mbox.messages:
+            if ch not in file_hashes:
                 config.logger.error(
-                    f"Bad CH in route_cloud_messages {ch}, {mbox!r} {msg!r}")
-            dest = cfg.direct_message(msg)
+                    f"Bad CH in route_cloud_messages {ch}, {mbox!r} {mbox.messages[ch]!r}"
+                )
+
+    # The default direct_message sends everything to the first local mailbox,
+    # so skip the per-message call and merge the dicts wholesale.
+    if direct == cfg._direct_message:
+        dest = msgs[cfg.local_mboxes[0]]
+        for mbox in cfg.cloud_mboxes:
+            dest.update(mbox.messages)
+        return msgs
+
+    # When the configuration promises direct_message only depends on the
+    # message content and cloud mailbox, only call it for messages that were
+    # not present in the cloud mailbox during the last routing pass.
+    pure = cfg.direct_message_is_pure
+    for mbox in cfg.cloud_mboxes:
+        old_routes = mbox.routes
+        routes = {}
+        for ch, msg in mbox.messages.items():
+            dest = old_routes.get(ch) if pure else None
+            if dest is None:
+                dest = direct(msg)
+            if pure:
+                routes[ch] = dest
             msgs[dest][ch] = msg
+        mbox.routes = routes
     return msgs
 
 
@@ -42,12 +66,14 @@ async def update_cloud_from_local(cfg: config.Config,
                                   offline_mode=False):
     """Detect differences made by the local mailboxes and upload them to the
     cloud."""
-    msgs_by_cloud: Dict[mailbox.Mailbox, messages.CHMsgMappingDict_Type] = {}
-    for mbox in cfg.cloud_mboxes:
-        msgs_by_cloud[mbox] = {}
+    msgs_by_cloud: Dict[mailbox.Mailbox, messages.CHMsgMappingDict_Type] = {
+        mbox: {}
+        for mbox in cfg.cloud_mboxes
+    }
     for local_mbox, msgdict in msgs_by_local.items():
+        local_get = local_mbox.messages.get
         for ch, cloud_msg in msgdict.items():
-            lmsg = local_mbox.messages.get(ch)
+            lmsg = local_get(ch)
             # When doing the first sweep in offline mode ignore missing local
             # messages, only synchronize message flags.
             if lmsg is None and offline_mode:
@@ -67,10 +93,16 @@ async def synchronize_mail(cfg: config.Config):
         await asyncio_complete(*(mbox.setup_mbox()
                                  for mbox in cfg.all_mboxes()))
 
+        fetch_sem = asyncio.Semaphore(cfg.max_concurrent_fetches)
+
+        async def update_message_list(mbox: mailbox.Mailbox):
+            async with fetch_sem:
+                await mbox.update_message_list()
+
         msgs = None
         while True:
             try:
-                await asyncio_complete(*(mbox.update_message_list()
+                await asyncio_complete(*(update_message_list(mbox)
                                          for mbox in cfg.all_mboxes()
                                          if mbox.need_update))
 
@@ -94,13 +126,18 @@ async def synchronize_mail(cfg: config.Config):
                 await asyncio.sleep(10)
                 continue
 
+            # Let anything following the trace see the whole cycle
+            if cfg.trace_file is not None:
+                cfg.trace_file.flush()
             await mailbox.Mailbox.changed_event.wait()
+            await asyncio.sleep(cfg.coalesce_window)
             mailbox.Mailbox.changed_event.clear()
             cfg.msgdb.cleanup_msgs(msgs)
             cfg.logger.debug("Changed event, looping")
     finally:
         for I in cfg.async_tasks:
             await I.close()
+        await cfg.close_resolver()
 
 
 def main():
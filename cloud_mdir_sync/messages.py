@@ -16,7 +16,7 @@ from typing import TYPE_CHECKING, Dict, Optional, Set, Tuple
 
 import cryptography
 import cryptography.exceptions
-from cryptography.fernet import Fernet
+import cryptography.fernet
 
 from . import config, util
 
@@ -344,7 +344,7 @@ class MessageDB(object):
             del self.inode_hashes[ino]
 
     def _encrypt_authenticators(self):
-        crypto = Fernet(self.cfg.storage_key)
+        crypto = self.cfg.storage_crypto
         return crypto.encrypt(
             pickle.dumps({
                 k: v
@@ -355,7 +355,7 @@ class MessageDB(object):
     def _load_authenticators(self, data):
         if data is None:
             return
-        crypto = Fernet(self.cfg.storage_key)
+        crypto = self.cfg.storage_crypto
         try:
             plain_data = crypto.decrypt(data)
         except (cryptography.exceptions.InvalidSignature,
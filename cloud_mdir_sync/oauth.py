@@ -1,14 +1,18 @@
 # SPDX-License-Identifier: GPL-2.0+
 import asyncio
 import base64
+import collections
 import hashlib
 import os
 import secrets
+import socket
+import time
 import webbrowser
 from abc import abstractmethod
-from typing import TYPE_CHECKING, Dict, List, Optional
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
 
 import aiohttp
+import aiohttp.abc
 import aiohttp.web
 import oauthlib
 import oauthlib.oauth2
@@ -31,15 +35,41 @@ class Account(object):
     async def get_xoauth2_bytes(self, proto: str) -> Optional[bytes]:
         return None
 
+class CachingResolver(aiohttp.abc.AbstractResolver):
+    """A DNS resolver that caches results for ttl seconds. aiohttp keeps its
+    DNS cache inside each connector, this allows the connectors of all the
+    accounts to share one cache."""
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._resolver = aiohttp.DefaultResolver()
+        self._cache: Dict[Tuple[str, int, int], Tuple[float, Any]] = {}
+
+    async def resolve(self, host: str, port: int = 0,
+                      family: int = socket.AF_INET):
+        key = (host, port, family)
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+        res = await self._resolver.resolve(host, port, family)
+        self._cache[key] = (time.monotonic() + self.ttl, res)
+        return res
+
+    async def close(self):
+        await self._resolver.close()
+
+
 class WebServer(object):
     """A small web server is used to manage oauth requests. The user should point a browser
     window at localhost. The program will generate redirects for the browser to point at
     OAUTH servers when interactive authentication is required."""
     url = "http://127.0.0.1:8080/"
     runner = None
+    # Oldest pending interactive authentications are failed beyond this
+    max_auth_redirs = 32
 
     def __init__(self):
-        self.auth_redirs = {}
+        self.auth_redirs: "collections.OrderedDict[str, tuple]" = (
+            collections.OrderedDict())
         self.web_app = aiohttp.web.Application()
         self.web_app.router.add_get("/", self._start)
         self.web_app.router.add_get("/oauth2/msal", self._oauth2_redirect)
@@ -61,7 +91,7 @@ class WebServer(object):
         based authentication.  The flow will resume when the OAUTH server
         redirects back to the localhost server.  The final query paremeters
         will be returned by this function"""
-        queue = asyncio.Queue()
+        fut = asyncio.get_event_loop().create_future()
 
         # If this is the first auth to start then automatically launch a
         # browser, otherwise assume the already running browser will take care
@@ -75,15 +105,24 @@ class WebServer(object):
             print(
                 f"Goto {self.url} in a web browser to authenticate (reusing browser)"
             )
-        self.auth_redirs[state] = (url, queue, redir_url)
-        return await queue.get()
+        while len(self.auth_redirs) >= self.max_auth_redirs:
+            _, (_, old_fut, _) = self.auth_redirs.popitem(last=False)
+            if not old_fut.done():
+                old_fut.set_exception(
+                    RuntimeError("Too many pending OAUTH authentications"))
+        self.auth_redirs[state] = (url, fut, redir_url)
+        try:
+            return await fut
+        finally:
+            if state in self.auth_redirs and self.auth_redirs[state][1] is fut:
+                del self.auth_redirs[state]
 
     def _start(self, request: aiohttp.web.Request):
         """Feed redirects to the web browser until all authing is done.  FIXME: Some
         fancy java script should be used to fetch new interactive auth
         requests"""
-        for I in self.auth_redirs.values():
-            raise aiohttp.web.HTTPFound(I[0])
+        if self.auth_redirs:
+            return self._redirect(self._next_auth_url())
         return aiohttp.web.Response(text="Authentication done")
 
     def _oauth2_redirect(self, request: aiohttp.web.Request):
@@ -92,19 +131,29 @@ class WebServer(object):
         if state is None:
             raise aiohttp.web.HTTPBadRequest(text="No state parameter")
         try:
-            _, queue, redir_url = self.auth_redirs[state]
+            _, fut, redir_url = self.auth_redirs[state]
             # RFC8252 8.10
             if redir_url != self.url[:-1] + request.path:
                 raise aiohttp.web.HTTPBadRequest(
                     text="Invalid redirection path")
             del self.auth_redirs[state]
-            queue.put_nowait(request.query)
+            if not fut.done():
+                fut.set_result(request.query)
         except KeyError:
             pass
 
-        for I in self.auth_redirs.values():
-            raise aiohttp.web.HTTPFound(I[0])
-        raise aiohttp.web.HTTPFound(self.url)
+        if self.auth_redirs:
+            return self._redirect(self._next_auth_url())
+        return self._redirect(self.url)
+
+    def _next_auth_url(self) -> str:
+        """The URL of the oldest pending interactive authentication"""
+        return next(iter(self.auth_redirs.values()))[0]
+
+    @staticmethod
+    def _redirect(url: str) -> aiohttp.web.Response:
+        """A 302 response, returned rather than raising HTTPFound"""
+        return aiohttp.web.Response(status=302, headers={"Location": url})
 
 
 class NativePublicApplicationClient(oauthlib.oauth2.WebApplicationClient):
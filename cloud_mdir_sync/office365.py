@@ -108,7 +108,7 @@ class GraphAPI(oauth.Account):
             self.owa_token = auth
             # the msal version used a string here
 
-        connector = aiohttp.connector.TCPConnector(
+        connector = self.cfg.new_connector(
             limit=MAX_CONCURRENT_OPERATIONS,
             limit_per_host=MAX_CONCURRENT_OPERATIONS)
         self.session = aiohttp.ClientSession(connector=connector,